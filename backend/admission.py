@@ -0,0 +1,179 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger("admission")
+
+
+class Overloaded(Exception):
+    pass
+
+
+class PriorityLimiter:
+    """Concurrency limiter that admits queued waiters lowest priority value first"""
+
+    def __init__(self, limit: int, max_queue: int = 100):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self._waiters = []
+        self._seq = itertools.count()
+
+    async def acquire(self, priority: int = 0, timeout: Optional[float] = None):
+        if self.active < self.limit and self.waiting == 0:
+            self.active += 1
+            return
+        if self.waiting >= self.max_queue:
+            raise Overloaded("queue full")
+        if timeout is not None and timeout <= 0:
+            raise Overloaded("no time left to queue")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self.waiting += 1
+        try:
+            # A slot handed over by release() keeps ``active`` unchanged
+            await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return
+            raise Overloaded("queue wait deadline exceeded")
+        except asyncio.CancelledError:
+            # Pass on a slot that was handed over just before cancellation
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+class RouteClass:
+    def __init__(self, name: str, limit: int, max_wait: float, priority: int, retry_after: int = 1):
+        self.name = name
+        self.priority = priority
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.limiter = PriorityLimiter(limit)
+
+
+# String values pydantic accepts for bool query parameters
+_TRUE_VALUES = {"1", "on", "t", "true", "y", "yes"}
+_FALSE_VALUES = {"0", "off", "f", "false", "n", "no"}
+
+
+def _query_bool(query: Dict[str, list], name: str, default: bool) -> bool:
+    """Read a bool query parameter the way FastAPI coerces it; invalid values keep the default"""
+    values = query.get(name)
+    if not values:
+        return default
+    value = values[-1].strip().lower()
+    if value in _TRUE_VALUES:
+        return True
+    if value in _FALSE_VALUES:
+        return False
+    return default
+
+
+def classify(scope) -> Optional[str]:
+    """Map a request to a route class; None means it bypasses admission control"""
+    path = scope.get("path", "")
+    if not path.startswith("/api/") or path.startswith("/api/admin/"):
+        return None
+    # Batch sub-requests re-enter the app and are admitted individually
+    if path == "/api/batch":
+        return None
+    # Webhooks only enqueue work and must answer quickly
+    if path.startswith("/api/webhooks/"):
+        return None
+    if path == "/api/emails/labels/bulk":
+        return "bulk"
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    if path == "/api/emails" and not _query_bool(query, "preview_only", True):
+        return "hydration"
+    # The stream endpoint hydrates by default
+    if path == "/api/emails/stream" and not _query_bool(query, "preview_only", False):
+        return "hydration"
+    return "interactive"
+
+
+class AdmissionMiddleware:
+    """ASGI middleware enforcing per-class concurrency limits and a shared upstream pool.
+
+    Each request first takes a slot in its route class, then a slot in the
+    shared pool, where interactive reads are admitted ahead of hydration and
+    bulk work. A request that cannot be admitted before its class deadline is
+    rejected with 503 and ``Retry-After``.
+    """
+
+    def __init__(self, app, classes: Dict[str, RouteClass], pool: PriorityLimiter):
+        self.app = app
+        self.classes = classes
+        self.pool = pool
+
+    async def __call__(self, scope, receive, send):
+        route_class = self.classes.get(classify(scope)) if scope["type"] == "http" else None
+        if route_class is None:
+            return await self.app(scope, receive, send)
+
+        deadline = time.monotonic() + route_class.max_wait
+        try:
+            await route_class.limiter.acquire(timeout=route_class.max_wait)
+        except Overloaded as e:
+            return await self._reject(route_class, str(e), scope, receive, send)
+        try:
+            try:
+                await self.pool.acquire(route_class.priority, timeout=deadline - time.monotonic())
+            except Overloaded as e:
+                return await self._reject(route_class, str(e), scope, receive, send)
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                self.pool.release()
+        finally:
+            route_class.limiter.release()
+
+    async def _reject(self, route_class: RouteClass, reason: str, scope, receive, send):
+        logger.warning(f"Shedding {scope.get('method')} {scope.get('path')} ({route_class.name}): {reason}")
+        response = JSONResponse(
+            {"detail": f"Server is busy, please retry ({reason})"},
+            status_code=503,
+            headers={"Retry-After": str(route_class.retry_after)}
+        )
+        await response(scope, receive, send)
+
+
+def _route_class(name: str, limit: int, max_wait: float, priority: int) -> RouteClass:
+    prefix = f"ADMISSION_{name.upper()}"
+    return RouteClass(
+        name,
+        limit=int(os.getenv(f"{prefix}_LIMIT", str(limit))),
+        max_wait=float(os.getenv(f"{prefix}_MAX_WAIT", str(max_wait))),
+        priority=priority,
+        retry_after=int(os.getenv(f"{prefix}_RETRY_AFTER", "1"))
+    )
+
+
+def install_admission_control(app):
+    classes = {
+        "interactive": _route_class("interactive", limit=32, max_wait=2.0, priority=0),
+        "hydration": _route_class("hydration", limit=4, max_wait=5.0, priority=1),
+        "bulk": _route_class("bulk", limit=2, max_wait=10.0, priority=2),
+    }
+    pool = PriorityLimiter(int(os.getenv("ADMISSION_UPSTREAM_LIMIT", "32")))
+    app.add_middleware(AdmissionMiddleware, classes=classes, pool=pool)
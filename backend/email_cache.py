@@ -0,0 +1,336 @@
+import sys
+import time
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger("email_cache")
+
+# Rough per-object overheads used for byte accounting (CPython, 64-bit)
+_RECORD_OVERHEAD = 200
+_STR_OVERHEAD = 49
+_QUERY_OVERHEAD = 120
+_ID_REF_SIZE = 8
+
+
+def _str(value: Any) -> str:
+    return value if isinstance(value, str) else ("" if value is None else str(value))
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    """Intern low-cardinality strings (labels, campaign ids) so records share them"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _addresses(value: Any) -> Tuple[Tuple[str, str], ...]:
+    if not isinstance(value, list):
+        return ()
+    return tuple(
+        (_str(item.get("address")), _str(item.get("name")))
+        for item in value if isinstance(item, dict)
+    )
+
+
+def _tags(value: Any) -> Tuple[str, ...]:
+    """Tag ids from a list of ids or of tag records"""
+    if not isinstance(value, list):
+        return ()
+    tags = []
+    for item in value:
+        if isinstance(item, dict):
+            item = item.get("_id") or item.get("id")
+        if item is not None and item != "":
+            tags.append(_intern(str(item)))
+    return tuple(tags)
+
+
+def _body(value: Any) -> Tuple[str, str]:
+    if isinstance(value, str):
+        return value, value
+    if isinstance(value, dict):
+        return _str(value.get("text")), _str(value.get("html"))
+    return "", ""
+
+
+class CachedEmail:
+    """Compact, normalized representation of a single Pipl.ai email"""
+
+    __slots__ = (
+        "id", "message_id", "subject", "from_address_email", "from_address_json",
+        "to_address_json", "cc_address_json", "timestamp_created", "content_preview",
+        "body_text", "body_html", "label", "campaign_id", "lead_id", "thread_id",
+        "tags", "is_unread", "thread_ids", "hydrated", "size"
+    )
+
+    @classmethod
+    def from_dict(cls, email: Dict[str, Any], hydrated: bool = False) -> "CachedEmail":
+        record = cls()
+        record.id = _str(email.get("id"))
+        record.message_id = _str(email.get("message_id"))
+        record.subject = _str(email.get("subject"))
+        record.from_address_email = _str(email.get("from_address_email"))
+        record.from_address_json = _addresses(email.get("from_address_json"))
+        record.to_address_json = _addresses(email.get("to_address_json"))
+        record.cc_address_json = _addresses(email.get("cc_address_json"))
+        record.timestamp_created = email.get("timestamp_created")
+        record.content_preview = _str(email.get("content_preview"))
+        record.body_text, record.body_html = _body(email.get("body"))
+        record.label = _intern(email.get("label"))
+        record.campaign_id = _intern(email.get("campaign_id"))
+        record.lead_id = email.get("lead_id")
+        record.thread_id = email.get("thread_id")
+        record.tags = _tags(email.get("tags"))
+        record.is_unread = bool(email.get("is_unread", False))
+        record.thread_ids = tuple(
+            _str(item.get("id")) for item in email.get("thread") or []
+            if isinstance(item, dict) and item.get("id")
+        )
+        record.hydrated = hydrated
+        record.size = record._estimate_size()
+        return record
+
+    def _estimate_size(self) -> int:
+        size = _RECORD_OVERHEAD
+        for value in (self.id, self.message_id, self.subject, self.from_address_email,
+                      self.timestamp_created, self.content_preview, self.body_text,
+                      self.body_html, self.lead_id, self.thread_id):
+            if isinstance(value, str):
+                size += _STR_OVERHEAD + len(value)
+        for addresses in (self.from_address_json, self.to_address_json, self.cc_address_json):
+            for address, name in addresses:
+                size += 2 * _STR_OVERHEAD + len(address) + len(name)
+        size += _ID_REF_SIZE * (len(self.thread_ids) + len(self.tags))
+        return size
+
+    def merge(self, newer: "CachedEmail"):
+        """Take fresh fields from a newer copy without losing hydrated content"""
+        keep_body = self.hydrated and not newer.hydrated
+        body_text, body_html, thread_ids = self.body_text, self.body_html, self.thread_ids
+        for field in self.__slots__:
+            setattr(self, field, getattr(newer, field))
+        if keep_body:
+            self.body_text, self.body_html = body_text, body_html
+            self.hydrated = True
+        if not self.thread_ids:
+            self.thread_ids = thread_ids
+        self.size = self._estimate_size()
+
+    def merge_content(self, message: "CachedEmail"):
+        """Take the body of a thread message without touching list metadata.
+
+        Thread payloads are sparse, so their label, read state and ids are
+        missing or defaults rather than fresh values.
+        """
+        if self.hydrated or not message.hydrated:
+            return
+        self.body_text, self.body_html = message.body_text, message.body_html
+        self.hydrated = True
+        self.size = self._estimate_size()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "message_id": self.message_id,
+            "subject": self.subject,
+            "from_address_email": self.from_address_email,
+            "from_address_json": [{"address": a, "name": n} for a, n in self.from_address_json],
+            "to_address_json": [{"address": a, "name": n} for a, n in self.to_address_json],
+            "cc_address_json": [{"address": a, "name": n} for a, n in self.cc_address_json],
+            "timestamp_created": self.timestamp_created,
+            "content_preview": self.content_preview,
+            "body": {"text": self.body_text, "html": self.body_html},
+            "label": self.label,
+            "campaign_id": self.campaign_id,
+            "lead_id": self.lead_id,
+            "thread_id": self.thread_id,
+            "tags": list(self.tags),
+            "is_unread": self.is_unread,
+        }
+
+
+def project(email: Dict[str, Any], hydrated: bool = False) -> Dict[str, Any]:
+    """Give an uncached email the same shape that EmailCache.get returns"""
+    projected = CachedEmail.from_dict(email, hydrated=hydrated).to_dict()
+    projected["thread"] = [
+        CachedEmail.from_dict(thread_email, hydrated=True).to_dict()
+        for thread_email in email.get("thread") or []
+        if isinstance(thread_email, dict) and thread_email.get("id")
+    ] if hydrated else []
+    return projected
+
+
+class _QueryEntry:
+    __slots__ = ("ids", "refs", "hydrated", "label", "expires_at", "size")
+
+    def __init__(self, ids: Tuple[str, ...], refs: Tuple[str, ...], hydrated: bool,
+                 label: Optional[str], expires_at: float, size: int):
+        self.ids = ids
+        self.refs = refs
+        self.hydrated = hydrated
+        self.label = label
+        self.expires_at = expires_at
+        self.size = size
+
+
+class EmailCache:
+    """Byte-bounded email cache that stores each email once, keyed by id.
+
+    Query results (one per filter combination) only hold tuples of email ids.
+    Records are reference counted by the queries that point at them and are
+    dropped together with the last query that uses them. When the estimated
+    size exceeds ``max_bytes``, the least recently used queries are evicted.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, ttl: float = 300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._records: Dict[str, CachedEmail] = {}
+        self._refcounts: Dict[str, int] = {}
+        self._queries: "OrderedDict[str, _QueryEntry]" = OrderedDict()
+        self._bytes = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._queries)
+
+    def __contains__(self, key: str) -> bool:
+        return self._live_entry(key) is not None
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Rebuild the email list for a cached query, or return None on a miss"""
+        entry = self._live_entry(key)
+        if entry is None:
+            return None
+        self._queries.move_to_end(key)
+        emails = []
+        for email_id in entry.ids:
+            record = self._records[email_id]
+            email = record.to_dict()
+            if entry.hydrated:
+                email["thread"] = [
+                    self._records[thread_id].to_dict()
+                    for thread_id in record.thread_ids if thread_id in self._records
+                ]
+            else:
+                email["thread"] = []
+            emails.append(email)
+        return emails
+
+    def set(self, key: str, emails: List[Dict[str, Any]], hydrated: bool = False, label: Optional[str] = None):
+        """Store the result of a query, sharing records with other queries.
+
+        ``label`` is the label filter the query was made with, if any, so that
+        label changes can drop results that no longer match.
+        """
+        self._remove(key)
+
+        ids = []
+        refs = []
+        for position, email in enumerate(emails):
+            for thread_email in email.get("thread") or []:
+                if isinstance(thread_email, dict) and thread_email.get("id"):
+                    refs.append(self._upsert(CachedEmail.from_dict(thread_email, hydrated=True), thread=True))
+            record = CachedEmail.from_dict(email, hydrated=hydrated)
+            # Emails without an id can't be shared; key them by their place in this query
+            record_id = self._upsert(record, key=None if record.id else f"\0{key}\0{position}")
+            ids.append(record_id)
+            refs.append(record_id)
+
+        refs = tuple(dict.fromkeys(refs))
+        for record_id in refs:
+            self._refcounts[record_id] = self._refcounts.get(record_id, 0) + 1
+
+        size = _QUERY_OVERHEAD + len(key) + _ID_REF_SIZE * (len(ids) + len(refs))
+        self._queries[key] = _QueryEntry(tuple(ids), refs, hydrated, label, time.monotonic() + self.ttl, size)
+        self._bytes += size
+        self._evict()
+
+    def patch_labels(self, labels: Dict[str, str]) -> int:
+        """Update labels of cached records in place; returns the number patched.
+
+        Label-filtered queries that contain a relabeled email, or that filter on
+        one of the new labels, no longer match upstream and are dropped.
+        """
+        new_labels = set(labels.values())
+        for key, entry in list(self._queries.items()):
+            if entry.label is not None and (entry.label in new_labels or any(i in labels for i in entry.ids)):
+                self._remove(key)
+
+        patched = 0
+        for email_id, label in labels.items():
+            record = self._records.get(email_id)
+            if record is not None:
+                record.label = _intern(label)
+                patched += 1
+        return patched
+
+    def patch_unread(self, email_ids: Dict[str, bool], thread_ids: Optional[Dict[str, bool]] = None) -> int:
+        """Update read state of cached records by email id and/or thread id"""
+        patched = 0
+        for email_id, is_unread in email_ids.items():
+            record = self._records.get(email_id)
+            if record is not None:
+                record.is_unread = is_unread
+                patched += 1
+        if thread_ids:
+            for record in self._records.values():
+                if record.thread_id in thread_ids:
+                    record.is_unread = thread_ids[record.thread_id]
+                    patched += 1
+        return patched
+
+    def clear(self):
+        self._records.clear()
+        self._refcounts.clear()
+        self._queries.clear()
+        self._bytes = 0
+
+    def _live_entry(self, key: str) -> Optional[_QueryEntry]:
+        entry = self._queries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        return entry
+
+    def _upsert(self, record: CachedEmail, key: Optional[str] = None, thread: bool = False) -> str:
+        """Store a record under ``key`` (its id by default); thread messages only add content"""
+        key = record.id if key is None else key
+        existing = self._records.get(key)
+        if existing is None:
+            self._records[key] = record
+            self._bytes += record.size
+        else:
+            self._bytes -= existing.size
+            if thread:
+                existing.merge_content(record)
+            else:
+                existing.merge(record)
+            self._bytes += existing.size
+        return key
+
+    def _remove(self, key: str):
+        entry = self._queries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        for record_id in entry.refs:
+            count = self._refcounts.get(record_id, 0) - 1
+            if count > 0:
+                self._refcounts[record_id] = count
+                continue
+            self._refcounts.pop(record_id, None)
+            record = self._records.pop(record_id, None)
+            if record is not None:
+                self._bytes -= record.size
+
+    def _evict(self):
+        # Always keep the most recent query, even if it alone exceeds the budget
+        while self._bytes > self.max_bytes and len(self._queries) > 1:
+            key = next(iter(self._queries))
+            logger.debug(f"Evicting email cache entry {key} ({self._bytes} bytes in use)")
+            self._remove(key)
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import time
+from typing import List, Dict, Any, Optional, Iterable
+
+from piplai import PiplAPI, pipl_api
+from providers import normalize_lead
+
+logger = logging.getLogger("lead_index")
+
+
+class LeadIndex:
+    """In-memory email-address-to-lead index built from paged get_leads sweeps.
+
+    A full sweep rebuilds the index from scratch; incremental sweeps read the
+    most recently modified leads first and stop at the first page that holds
+    nothing newer than what the index has already seen.
+    """
+
+    def __init__(self, api: PiplAPI, page_size: int = 100, max_pages: int = 1000):
+        self.api = api
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.by_email: Dict[str, Dict[str, Any]] = {}
+        self.synced_at: Optional[float] = None
+        self._latest_modified: Optional[str] = None
+
+    @staticmethod
+    def _key(address: Optional[str]) -> str:
+        return (address or "").strip().lower()
+
+    async def _fetch_page(self, page: int, sort: str, direction: str) -> List[Dict[str, Any]]:
+        response = await self.api.get_leads(
+            page=page, limit=self.page_size, sort=sort, direction=direction, raise_errors=True
+        )
+        return response.get("data", [])
+
+    def _add(self, index: Dict[str, Dict[str, Any]], lead: Dict[str, Any], advance_cursor: bool = True):
+        key = self._key(lead.get("email"))
+        if not key:
+            return
+        record = normalize_lead(lead, "pipl")
+        record["modified_at"] = lead.get("modified_at")
+        index[key] = record
+        modified = lead.get("modified_at")
+        if advance_cursor and modified and (self._latest_modified is None or modified > self._latest_modified):
+            self._latest_modified = modified
+
+    async def full_sync(self):
+        """Rebuild the index from every page of workspace leads.
+
+        A page that fails to load aborts the rebuild and keeps the current index.
+        """
+        index: Dict[str, Dict[str, Any]] = {}
+        latest_modified = self._latest_modified
+        try:
+            for page in range(1, self.max_pages + 1):
+                leads = await self._fetch_page(page, sort="_id", direction="asc")
+                for lead in leads:
+                    self._add(index, lead)
+                if len(leads) < self.page_size:
+                    break
+        except Exception:
+            # Leads from the discarded sweep must not move the incremental cursor
+            self._latest_modified = latest_modified
+            raise
+        self.by_email = index
+        self.synced_at = time.time()
+        logger.info(f"Lead index rebuilt with {len(self.by_email)} addresses")
+
+    async def incremental_sync(self):
+        """Pick up leads modified since the last sweep"""
+        if self._latest_modified is None:
+            return await self.full_sync()
+        since = self._latest_modified
+        updated = 0
+        for page in range(1, self.max_pages + 1):
+            leads = await self._fetch_page(page, sort="modified_at", direction="desc")
+            newer = [lead for lead in leads if (lead.get("modified_at") or "") > since]
+            for lead in newer:
+                self._add(self.by_email, lead)
+            updated += len(newer)
+            if len(newer) < len(leads) or len(leads) < self.page_size:
+                break
+        self.synced_at = time.time()
+        if updated:
+            logger.info(f"Lead index updated {updated} leads")
+
+    def upsert(self, lead: Dict[str, Any]):
+        """Add or replace a single lead, e.g. from a webhook event.
+
+        The sweep cursor is left alone, so leads changed before this one that
+        have not been swept yet are still picked up by ``incremental_sync``.
+        """
+        self._add(self.by_email, lead, advance_cursor=False)
+
+    def get(self, address: Optional[str]) -> Optional[Dict[str, Any]]:
+        return self.by_email.get(self._key(address))
+
+    def lookup(self, addresses: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        return {address: self.get(address) for address in addresses}
+
+    def annotate(self, email: Dict[str, Any]) -> Dict[str, Any]:
+        """Attach the lead for an email's sender, or its first recipient for sent mail"""
+        lead = self.get(email.get("from_address_email"))
+        if lead is None:
+            for recipient in email.get("to_address_json") or []:
+                lead = self.get(recipient.get("address"))
+                if lead is not None:
+                    break
+        email["lead"] = lead
+        return email
+
+    async def run(self, full_interval: float, incremental_interval: float):
+        """Keep the index fresh until cancelled"""
+        last_full = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_full >= full_interval:
+                    await self.full_sync()
+                    last_full = time.monotonic()
+                else:
+                    await self.incremental_sync()
+            except Exception as e:
+                logger.error(f"Error syncing lead index: {str(e)}")
+            await asyncio.sleep(incremental_interval)
+
+
+# Create a singleton instance
+lead_index = LeadIndex(
+    pipl_api,
+    page_size=int(os.getenv("LEAD_INDEX_PAGE_SIZE", "100")),
+    max_pages=int(os.getenv("LEAD_INDEX_MAX_PAGES", "1000"))
+)
@@ -1,5 +1,6 @@
-from fastapi import FastAPI, HTTPException, Depends, Query
+from fastapi import FastAPI, HTTPException, Depends, Query, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.openapi.utils import get_openapi
 import yaml
@@ -10,7 +11,20 @@ from dotenv import load_dotenv
 from typing import List, Optional, Dict, Any, Union
 from pydantic import BaseModel, EmailStr
 from piplai import pipl_api
+from outbox import outbox
+from providers import (
+    providers, get_merged_emails, resolve_id, UnsupportedOperation,
+    PROVIDER_TIMEOUT, PROVIDER_HYDRATION_TIMEOUT
+)
+from profiling import install_profiling, profile_store, PROFILE_ADMIN_TOKEN
+from admission import install_admission_control
+from lead_index import lead_index
+from webhooks import webhook_processor, verify_signature, WEBHOOK_SECRET
 import httpx
+import asyncio
+import json
+import posixpath
+from urllib.parse import urlsplit, unquote, quote
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -27,6 +41,9 @@ app = FastAPI(
     redoc_url=None  # Disable default redoc
 )
 
+# Admission control is added before CORS so that 503 responses still carry CORS headers
+install_admission_control(app)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -37,6 +54,9 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
+# Request profiling (no-op unless PROFILE_TOKEN or PROFILE_SAMPLE_RATE is set)
+install_profiling(app)
+
 # Load OpenAPI specification
 openapi_path = Path(__file__).parent / "openapi.yaml"
 with open(openapi_path, "r") as f:
@@ -47,6 +67,31 @@ def custom_openapi():
 
 app.openapi = custom_openapi
 
+# How often campaign and tag metadata is reloaded in the background
+METADATA_REFRESH_INTERVAL = float(os.getenv("PIPL_METADATA_REFRESH_INTERVAL", "900"))
+
+# Lead index sweeps: a full rebuild now and then, incremental updates in between
+LEAD_INDEX_FULL_INTERVAL = float(os.getenv("LEAD_INDEX_FULL_INTERVAL", "3600"))
+LEAD_INDEX_INCREMENTAL_INTERVAL = float(os.getenv("LEAD_INDEX_INCREMENTAL_INTERVAL", "60"))
+
+@app.on_event("startup")
+async def startup():
+    await outbox.start()
+    app.state.metadata_task = asyncio.create_task(
+        pipl_api.run_metadata_refresh(METADATA_REFRESH_INTERVAL)
+    )
+    app.state.lead_index_task = asyncio.create_task(
+        lead_index.run(LEAD_INDEX_FULL_INTERVAL, LEAD_INDEX_INCREMENTAL_INTERVAL)
+    )
+    webhook_processor.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.metadata_task.cancel()
+    app.state.lead_index_task.cancel()
+    webhook_processor.stop()
+    await outbox.stop()
+
 @app.get("/docs", include_in_schema=False)
 async def custom_swagger_ui_html():
     return get_swagger_ui_html(
@@ -95,6 +140,42 @@ class TagRequest(BaseModel):
     campaign_id: str
     tags: List[str]
 
+class LabelUpdate(BaseModel):
+    email_id: str
+    label: str
+
+class BulkLabelRequest(BaseModel):
+    updates: List[LabelUpdate]
+
+class LeadLookupRequest(BaseModel):
+    emails: List[str]
+
+class BatchSubRequest(BaseModel):
+    id: Optional[str] = None
+    method: str = "GET"
+    path: str
+    params: Optional[Dict[str, Any]] = None
+    body: Optional[Any] = None
+    headers: Optional[Dict[str, str]] = None
+
+class BatchRequest(BaseModel):
+    requests: List[BatchSubRequest]
+
+# Maximum number of sub-requests accepted by /api/batch
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "20"))
+# Sub-request headers passed through to the handlers; others are dropped
+BATCH_FORWARDED_HEADERS = {"idempotency-key", "x-admin-token"}
+
+# Limits for bulk label updates sent upstream
+MAX_BULK_LABEL_UPDATES = int(os.getenv("MAX_BULK_LABEL_UPDATES", "500"))
+LABEL_UPDATE_CONCURRENCY = int(os.getenv("LABEL_UPDATE_CONCURRENCY", "10"))
+
+# Maximum number of addresses resolved by one /api/leads/lookup call
+MAX_LEAD_LOOKUP = int(os.getenv("MAX_LEAD_LOOKUP", "1000"))
+
+# Number of threads hydrated at once behind /api/emails/stream
+STREAM_HYDRATION_CONCURRENCY = int(os.getenv("STREAM_HYDRATION_CONCURRENCY", "8"))
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to Investor Email Manager API"}
@@ -105,37 +186,111 @@ async def get_emails(
     email_type: str = "all",
     label: Optional[str] = None,
     lead_email: Optional[str] = None,
-    campaign_id: Optional[str] = None
+    campaign_id: Optional[str] = None,
+    enrich: bool = False,
+    include_lead: bool = False
 ):
-    """Get emails from Pipl.ai"""
+    """Get emails from all configured providers, newest first"""
     try:
-        emails = await pipl_api.get_emails(
+        if enrich:
+            await pipl_api.ensure_metadata()
+        emails = await get_merged_emails(
+            providers,
+            timeout=PROVIDER_TIMEOUT if preview_only else PROVIDER_HYDRATION_TIMEOUT,
             preview_only=preview_only,
             lead_email=lead_email,
             campaign_id=campaign_id,
             email_type=email_type,
             label=label
         )
-        return emails
+        if enrich:
+            emails = (pipl_api.enrich(email) for email in emails)
+        if include_lead:
+            emails = (lead_index.annotate(email) for email in emails)
+        return list(emails)
+    except asyncio.TimeoutError as e:
+        logger.error(f"Error in get_emails endpoint: {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e) or "Email providers timed out")
     except Exception as e:
         logger.error(f"Error in get_emails endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/emails/send")
-async def send_email(data: SendEmailRequest):
-    """Send email through Pipl.ai"""
+@app.get("/api/emails/stream")
+async def stream_emails(
+    preview_only: bool = False,
+    email_type: str = "all",
+    label: Optional[str] = None,
+    lead_email: Optional[str] = None,
+    campaign_id: Optional[str] = None,
+    enrich: bool = False,
+    include_lead: bool = False
+):
+    """Stream emails from Pipl.ai as NDJSON, one line per email as soon as it is hydrated"""
+    # Fetch the list before committing to a 200, so upstream failures get a real status
     try:
-        response = await pipl_api.send_email(
+        if enrich:
+            await pipl_api.ensure_metadata()
+        emails = await pipl_api.stream_emails(
+            preview_only=preview_only,
+            lead_email=lead_email,
+            campaign_id=campaign_id,
+            email_type=email_type,
+            label=label,
+            concurrency=STREAM_HYDRATION_CONCURRENCY
+        )
+    except Exception as e:
+        logger.error(f"Error in stream_emails endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def ndjson():
+        try:
+            async for email in emails:
+                email["provider"] = "pipl"
+                if enrich:
+                    pipl_api.enrich(email)
+                if include_lead:
+                    lead_index.annotate(email)
+                yield json.dumps(email) + "\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure as a final line
+            logger.error(f"Error in stream_emails endpoint: {str(e)}")
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@app.post("/api/emails/send", status_code=202)
+async def send_email(
+    data: SendEmailRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Queue email for sending through the provider that owns the thread (Pipl.ai for new emails)"""
+    if data.reply_to_id:
+        try:
+            provider, _ = resolve_id(data.reply_to_id)
+        except UnsupportedOperation as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not provider.supports_replies:
+            raise HTTPException(status_code=400, detail=f"Provider {provider.name} does not support replies")
+    try:
+        return await outbox.enqueue(
             to=data.to,
             subject=data.subject,
             body=data.body,
-            reply_to_id=data.reply_to_id
+            reply_to_id=data.reply_to_id,
+            idempotency_key=idempotency_key
         )
-        return response
     except Exception as e:
         logger.error(f"Error in send_email endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/emails/send/{message_id}")
+async def get_send_status(message_id: str):
+    """Get delivery status of a queued email"""
+    message = await outbox.get(message_id)
+    if message is None:
+        raise HTTPException(status_code=404, detail=f"Message {message_id} not found")
+    return message
+
 @app.get("/api/campaigns")
 async def get_campaigns():
     """Get all campaigns"""
@@ -163,11 +318,50 @@ async def get_labels():
         logger.error(f"Error in get_labels endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/emails/labels/bulk")
+async def update_email_labels_bulk(data: BulkLabelRequest):
+    """Update labels for many emails at once"""
+    if len(data.updates) > MAX_BULK_LABEL_UPDATES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Request contains {len(data.updates)} updates, maximum is {MAX_BULK_LABEL_UPDATES}"
+        )
+    try:
+        # Only Pipl.ai supports labels; report other providers' rows as failed
+        pipl_updates = []
+        results = []
+        for update in data.updates:
+            try:
+                provider, _ = resolve_id(update.email_id)
+            except UnsupportedOperation as e:
+                provider, error = None, str(e)
+            else:
+                error = f"Provider {provider.name} does not support labels"
+            if provider is not None and provider.name == "pipl":
+                pipl_updates.append(update.model_dump())
+            else:
+                results.append({"email_id": update.email_id, "label": update.label, "success": False, "error": error})
+        results = await pipl_api.update_email_labels(
+            pipl_updates,
+            concurrency=LABEL_UPDATE_CONCURRENCY
+        ) + results
+        return {
+            "updated": sum(1 for r in results if r["success"]),
+            "failed": sum(1 for r in results if not r["success"]),
+            "results": results
+        }
+    except Exception as e:
+        logger.error(f"Error in update_email_labels_bulk endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/api/emails/{email_id}/label")
 async def update_email_label(email_id: str, label: str):
     """Update email label"""
     try:
-        return await pipl_api.update_email_label(email_id, label)
+        provider, upstream_id = resolve_id(email_id)
+        return await provider.update_email_label(upstream_id, label)
+    except UnsupportedOperation as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error in update_email_label endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -176,15 +370,10 @@ async def update_email_label(email_id: str, label: str):
 async def mark_email_read(thread_id: str):
     """Mark email thread as read"""
     try:
-        data = {"workspace_id": os.getenv("PIPL_WORKSPACE_ID")}
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{pipl_api.base_url}/unibox/threads/{thread_id}/mark-as-read",
-                headers=pipl_api.headers,
-                json=data
-            )
-            response.raise_for_status()
-            return response.json()
+        provider, upstream_id = resolve_id(thread_id)
+        return await provider.mark_thread_read(upstream_id)
+    except UnsupportedOperation as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error in mark_email_read endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -217,12 +406,15 @@ async def get_leads(
     page: int = 1,
     limit: int = 10,
     sort: str = "_id",
-    direction: str = "asc"
+    direction: str = "asc",
+    enrich: bool = False
 ):
     """Get leads/contacts from Pipl.ai API"""
     try:
+        if enrich:
+            await pipl_api.ensure_metadata()
         # The PiplAPI.get_leads now returns a consistent response format
-        return await pipl_api.get_leads(
+        leads = await pipl_api.get_leads(
             campaign_id=campaign_id,
             status=status,
             label=label,
@@ -234,10 +426,126 @@ async def get_leads(
             sort=sort,
             direction=direction
         )
+        if enrich:
+            for lead in leads["data"]:
+                pipl_api.enrich(lead)
+        return leads
     except Exception as e:
         logger.error(f"Error in get_leads endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def require_profile_token(x_admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    """Restrict profile access to holders of PROFILE_ADMIN_TOKEN"""
+    if not PROFILE_ADMIN_TOKEN or x_admin_token != PROFILE_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_profile_token)])
+async def list_profiles():
+    """List stored request profiles, newest first"""
+    return profile_store.list()
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_profile_token)])
+async def get_profile(profile_id: str):
+    """Get a stored request profile as HTML"""
+    html = profile_store.read(profile_id)
+    if html is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return HTMLResponse(html)
+
+def _batch_path(path: str) -> Optional[str]:
+    """Resolve a sub-request path the way the router will see it; None if it is not allowed.
+
+    Dot segments and percent-escapes are resolved before checking, so
+    ``/api/./batch`` or ``/api/%62atch`` cannot re-enter the batch handler.
+    """
+    parts = urlsplit(path)
+    resolved = posixpath.normpath(unquote(parts.path))
+    if not resolved.startswith("/api/") or resolved == "/api/batch" or resolved.startswith("/api/batch/"):
+        return None
+    return quote(resolved) + (f"?{parts.query}" if parts.query else "")
+
+async def _run_sub_request(client: httpx.AsyncClient, index: int, sub: BatchSubRequest) -> Dict[str, Any]:
+    """Dispatch a single batch sub-request to this app in-process"""
+    sub_id = sub.id if sub.id is not None else str(index)
+    path = _batch_path(sub.path)
+    if path is None:
+        return {"id": sub_id, "status": 400, "body": {"detail": f"Unsupported path: {sub.path}"}}
+    headers = {
+        name: value for name, value in (sub.headers or {}).items()
+        if name.lower() in BATCH_FORWARDED_HEADERS
+    }
+    try:
+        response = await client.request(
+            sub.method.upper(),
+            path,
+            params=sub.params,
+            json=sub.body,
+            headers=headers
+        )
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        return {"id": sub_id, "status": response.status_code, "body": body}
+    except Exception as e:
+        logger.error(f"Error in batch sub-request {sub.method} {sub.path}: {str(e)}")
+        return {"id": sub_id, "status": 500, "body": {"detail": str(e)}}
+
+@app.post("/api/batch")
+async def batch(data: BatchRequest):
+    """Run several API requests concurrently and return all results in one response"""
+    if not data.requests:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one request")
+    if len(data.requests) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch contains {len(data.requests)} requests, maximum is {MAX_BATCH_SIZE}"
+        )
+
+    # Sub-requests go through the ASGI app directly, so they share handlers and caches
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://batch", timeout=60.0) as client:
+        responses = await asyncio.gather(*[
+            _run_sub_request(client, index, sub)
+            for index, sub in enumerate(data.requests)
+        ])
+    return {"responses": responses}
+
+@app.post("/api/webhooks/pipl", status_code=202)
+async def pipl_webhook(request: Request, x_pipl_signature: Optional[str] = Header(None)):
+    """Receive Pipl.ai events and queue them for application to the caches"""
+    body = await request.body()
+    if not verify_signature(WEBHOOK_SECRET, body, x_pipl_signature):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook body is not valid JSON")
+    events = payload if isinstance(payload, list) else [payload]
+    if not all(isinstance(event, dict) for event in events):
+        raise HTTPException(status_code=400, detail="Webhook body must be an event object or a list of them")
+    # Ids key the dedup cache, so they must be plain strings or numbers
+    if not all(isinstance(event.get("id"), (str, int, type(None))) for event in events):
+        raise HTTPException(status_code=400, detail="Webhook event id must be a string or an integer")
+    try:
+        return webhook_processor.submit(events)
+    except asyncio.QueueFull:
+        logger.warning("Webhook queue is full, asking sender to retry")
+        raise HTTPException(status_code=503, detail="Webhook queue is full", headers={"Retry-After": "5"})
+
+@app.post("/api/leads/lookup")
+async def lookup_leads(data: LeadLookupRequest):
+    """Resolve many email addresses to leads from the in-memory lead index"""
+    if len(data.emails) > MAX_LEAD_LOOKUP:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Request contains {len(data.emails)} addresses, maximum is {MAX_LEAD_LOOKUP}"
+        )
+    return {
+        "leads": lead_index.lookup(data.emails),
+        "synced_at": lead_index.synced_at
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
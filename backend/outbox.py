@@ -0,0 +1,251 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Dict, Any, Optional
+
+from providers import pipl_provider, resolve_id, UnsupportedOperation
+
+logger = logging.getLogger("outbox")
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id TEXT PRIMARY KEY,
+    idempotency_key TEXT UNIQUE,
+    to_address TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    reply_to_id TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    response TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, next_attempt_at);
+"""
+
+
+class Outbox:
+    """Durable SQLite queue for outbound emails, drained by background workers"""
+
+    def __init__(self,
+                 path: str,
+                 workers: int = 2,
+                 batch_size: int = 10,
+                 max_attempts: int = 5,
+                 retry_base_delay: float = 5.0,
+                 lease_timeout: float = 300.0):
+        self.path = path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        # A claimed message still "sending" after this long is assumed abandoned
+        self.lease_timeout = lease_timeout
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, fn):
+        with self._lock:
+            return fn(self._connect())
+
+    async def _run(self, fn):
+        return await asyncio.to_thread(self._execute, fn)
+
+    async def start(self):
+        """Start the drain workers"""
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Started outbox with {self.workers} workers at {self.path}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._conn is not None:
+            self._execute(lambda conn: conn.close())
+            self._conn = None
+
+    async def enqueue(self,
+                      to: str,
+                      subject: str,
+                      body: str,
+                      reply_to_id: Optional[str] = None,
+                      idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """Persist a message for sending; repeated idempotency keys return the original message"""
+        message_id = uuid.uuid4().hex
+        now = time.time()
+
+        def insert(conn):
+            try:
+                conn.execute(
+                    "INSERT INTO outbox (id, idempotency_key, to_address, subject, body, reply_to_id, "
+                    "status, created_at, updated_at, next_attempt_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (message_id, idempotency_key, to, subject, body, reply_to_id, QUEUED, now, now, now)
+                )
+                row_id = message_id
+            except sqlite3.IntegrityError:
+                row = conn.execute(
+                    "SELECT id FROM outbox WHERE idempotency_key = ?", (idempotency_key,)
+                ).fetchone()
+                row_id = row["id"]
+            return conn.execute("SELECT * FROM outbox WHERE id = ?", (row_id,)).fetchone()
+
+        row = await self._run(insert)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return self._to_dict(row)
+
+    async def get(self, message_id: str) -> Optional[Dict[str, Any]]:
+        row = await self._run(
+            lambda conn: conn.execute("SELECT * FROM outbox WHERE id = ?", (message_id,)).fetchone()
+        )
+        return self._to_dict(row) if row is not None else None
+
+    async def _claim_batch(self) -> List[sqlite3.Row]:
+        def claim(conn):
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Also reclaim messages whose sender died mid-send (possibly in another
+                # process); a live sender always finishes well within the lease
+                rows = conn.execute(
+                    "SELECT * FROM outbox WHERE (status = ? AND next_attempt_at <= ?) "
+                    "OR (status = ? AND updated_at <= ?) ORDER BY created_at LIMIT ?",
+                    (QUEUED, now, SENDING, now - self.lease_timeout, self.batch_size)
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE outbox SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    [(SENDING, now, row["id"]) for row in rows]
+                )
+                conn.execute("COMMIT")
+                return rows
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return await self._run(claim)
+
+    async def _next_due_in(self) -> Optional[float]:
+        row = await self._run(lambda conn: conn.execute(
+            "SELECT MIN(next_attempt_at) AS due FROM outbox WHERE status = ?", (QUEUED,)
+        ).fetchone())
+        if row is None or row["due"] is None:
+            return None
+        return max(0.0, row["due"] - time.time())
+
+    async def _deliver(self, row: sqlite3.Row):
+        attempts = row["attempts"] + 1
+        try:
+            # Replies go to the provider that owns the thread; new emails go to Pipl.ai
+            provider, reply_to_id = pipl_provider, None
+            if row["reply_to_id"]:
+                provider, reply_to_id = resolve_id(row["reply_to_id"])
+            response = await provider.send_email(
+                to=row["to_address"],
+                subject=row["subject"],
+                body=row["body"],
+                reply_to_id=reply_to_id
+            )
+        except Exception as e:
+            error = str(e)
+            logger.warning(f"Outbox send {row['id']} failed (attempt {attempts}): {error}")
+            now = time.time()
+            # Unsupported sends will never succeed, so don't retry them
+            if attempts >= self.max_attempts or isinstance(e, UnsupportedOperation):
+                status, next_attempt_at = FAILED, now
+            else:
+                status, next_attempt_at = QUEUED, now + self.retry_base_delay * (2 ** (attempts - 1))
+            await self._run(lambda conn: conn.execute(
+                "UPDATE outbox SET status = ?, last_error = ?, updated_at = ?, next_attempt_at = ? WHERE id = ?",
+                (status, error, now, next_attempt_at, row["id"])
+            ))
+            return
+        await self._mark_sent(row["id"], response)
+
+    async def _mark_sent(self, message_id: str, response: Any):
+        """Record a successful send, retrying the write until it sticks.
+
+        The email is already out, so a failed write must never put the message
+        back on the queue.
+        """
+        delay = 0.5
+        while True:
+            try:
+                await self._run(lambda conn: conn.execute(
+                    "UPDATE outbox SET status = ?, response = ?, last_error = NULL, updated_at = ? WHERE id = ?",
+                    (SENT, json.dumps(response), time.time(), message_id)
+                ))
+                return
+            except sqlite3.Error as e:
+                logger.error(f"Error recording outbox send {message_id} as sent, retrying: {str(e)}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    async def _worker(self, index: int):
+        while True:
+            try:
+                self._wakeup.clear()
+                rows = await self._claim_batch()
+                if rows:
+                    await asyncio.gather(*[self._deliver(row) for row in rows])
+                    continue
+                timeout = await self._next_due_in()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout if timeout is not None else 60.0)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox worker {index} error: {str(e)}")
+                await asyncio.sleep(1.0)
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "message_id": row["id"],
+            "status": row["status"],
+            "to": row["to_address"],
+            "subject": row["subject"],
+            "reply_to_id": row["reply_to_id"],
+            "attempts": row["attempts"],
+            "last_error": row["last_error"],
+            "response": json.loads(row["response"]) if row["response"] else None,
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"]
+        }
+
+
+# Create a singleton instance
+outbox = Outbox(
+    path=os.getenv("OUTBOX_DB_PATH", os.path.join(os.path.dirname(__file__), "outbox.db")),
+    workers=int(os.getenv("OUTBOX_WORKERS", "2")),
+    batch_size=int(os.getenv("OUTBOX_BATCH_SIZE", "10")),
+    max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5")),
+    lease_timeout=float(os.getenv("OUTBOX_LEASE_TIMEOUT", "300"))
+)
@@ -1,10 +1,13 @@
 import httpx
+import asyncio
 import os
+import time
 import logging
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, AsyncIterator, Iterable
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from cachetools import TTLCache
+from email_cache import EmailCache, project
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -21,10 +24,21 @@ class PiplAPI:
             "x-api-key": self.api_key,
             "Content-Type": "application/json"
         }
-        # Cache for emails with 5-minute TTL
-        self.email_cache = TTLCache(maxsize=100, ttl=300)
+        # Cache for emails with 5-minute TTL, bounded by estimated memory use
+        self.email_cache = EmailCache(
+            max_bytes=int(os.getenv("EMAIL_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+            ttl=300
+        )
         # Cache for labels with 1-hour TTL
         self.label_cache = TTLCache(maxsize=100, ttl=3600)
+        # Campaign and tag metadata keyed by id, refreshed in the background
+        self.campaigns_by_id: Dict[str, Dict[str, Any]] = {}
+        self.tags_by_id: Dict[str, Dict[str, Any]] = {}
+        self.metadata_ttl = float(os.getenv("PIPL_METADATA_TTL", "3600"))
+        # Retry failed metadata loads sooner than the TTL
+        self.metadata_retry = float(os.getenv("PIPL_METADATA_RETRY", "30"))
+        self.metadata_expires_at: Optional[float] = None
+        self._metadata_lock = asyncio.Lock()
         logger.info(f"Initialized PiplAPI with workspace_id: {self.workspace_id}")
 
     async def get_emails(self, 
@@ -37,22 +51,11 @@ class PiplAPI:
         cache_key = f"{preview_only}:{lead_email}:{campaign_id}:{email_type}:{label}"
         
         # Check cache first
-        if cache_key in self.email_cache:
-            return self.email_cache[cache_key]
-
-        # Only include supported parameters
-        params = {
-            "workspace_id": self.workspace_id,
-            "preview_only": "true" if preview_only else "false",
-            "email_type": email_type
-        }
-        if lead_email:
-            params["lead"] = lead_email
-        if campaign_id:
-            params["campaign_id"] = campaign_id
-        if label:
-            params["label"] = label
+        cached = self.email_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
+        params = self._email_list_params(preview_only, lead_email, campaign_id, email_type, label)
         logger.debug(f"Sending request to {self.base_url}/unibox/emails with params: {params}")
 
         try:
@@ -68,70 +71,15 @@ class PiplAPI:
                 # Transform and clean up emails
                 emails = data.get("data", [])
                 for email in emails:
-                    # Ensure required fields exist
-                    email["id"] = email.get("id", "")
-                    email["message_id"] = email.get("message_id", "")
-                    email["subject"] = email.get("subject", "")
-                    email["from_address_email"] = email.get("from_address_email", "")
-                    email["from_address_json"] = email.get("from_address_json", [{"address": email.get("from_address_email", ""), "name": ""}])
-                    email["to_address_json"] = email.get("to_address_json", [])
-                    email["cc_address_json"] = email.get("cc_address_json", [])
-                    email["timestamp_created"] = email.get("timestamp_created")
-                    email["content_preview"] = email.get("content_preview", "")
-                    
+                    self._normalize_email(email)
                     # If not preview_only, fetch the full email thread
-                    if not preview_only and email.get("thread_id"):
-                        try:
-                            thread_response = await client.get(
-                                f"{self.base_url}/unibox/thread/{email['thread_id']}",
-                                headers=self.headers,
-                                params={"workspace_id": self.workspace_id}
-                            )
-                            thread_response.raise_for_status()
-                            thread_data = thread_response.json()
-                            email["thread"] = thread_data.get("data", [])
-                            
-                            # Get the full body of the current email from the thread
-                            for thread_email in email["thread"]:
-                                if thread_email.get("id") == email["id"]:
-                                    body = thread_email.get("body", {})
-                                    if isinstance(body, str):
-                                        email["body"] = {"text": body, "html": body}
-                                    elif isinstance(body, dict):
-                                        email["body"] = {
-                                            "text": body.get("text", ""),
-                                            "html": body.get("html", "")
-                                        }
-                                    break
-                        except httpx.HTTPError as e:
-                            logger.warning(f"Error fetching thread {email.get('thread_id')}: {str(e)}")
-                            if hasattr(e, 'response') and e.response is not None:
-                                logger.warning(f"Response content: {e.response.text}")
-                            email["thread"] = []
-                    else:
-                        # Handle email body for preview
-                        body = email.get("body")
-                        if isinstance(body, str):
-                            email["body"] = {"text": body, "html": body}
-                        elif isinstance(body, dict):
-                            email["body"] = {
-                                "text": body.get("text", ""),
-                                "html": body.get("html", "")
-                            }
-                        else:
-                            email["body"] = {"text": "", "html": ""}
-                        email["thread"] = []
-                    
-                    # Handle other fields
-                    email["label"] = email.get("label")
-                    email["campaign_id"] = email.get("campaign_id")
-                    email["lead_id"] = email.get("lead_id")
-                    email["thread_id"] = email.get("thread_id")
-                    email["is_unread"] = email.get("is_unread", False)
+                    if not preview_only:
+                        await self._hydrate_email(client, email)
                 
                 # Cache all emails
-                self.email_cache[cache_key] = emails
-                return emails
+                self.email_cache.set(cache_key, emails, hydrated=not preview_only, label=label)
+                # Serve from the cache so hits and misses have the same shape
+                return self.email_cache.get(cache_key)
                 
         except httpx.HTTPError as e:
             logger.error(f"Error fetching emails: {str(e)}")
@@ -139,6 +87,146 @@ class PiplAPI:
                 logger.error(f"Response content: {e.response.text}")
             raise
 
+    async def stream_emails(self,
+                            preview_only: bool = False,
+                            lead_email: Optional[str] = None,
+                            campaign_id: Optional[str] = None,
+                            email_type: str = "all",
+                            label: Optional[str] = None,
+                            concurrency: int = 8) -> AsyncIterator[Dict[str, Any]]:
+        """Fetch the email list and return an iterator that yields each email once hydrated.
+
+        The list is fetched before this returns, so an upstream failure is
+        raised here rather than partway through a response. At most
+        ``concurrency`` threads are fetched at once, and the next batch only
+        starts as the consumer takes results, so hydrated threads never pile
+        up in memory. Emails are yielded in completion order and are not cached.
+        """
+        cache_key = f"{preview_only}:{lead_email}:{campaign_id}:{email_type}:{label}"
+        cached = self.email_cache.get(cache_key)
+        if cached is not None:
+            return self._iterate(cached)
+
+        params = self._email_list_params(preview_only, lead_email, campaign_id, email_type, label)
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            response = await client.get(
+                f"{self.base_url}/unibox/emails",
+                headers=self.headers,
+                params=params
+            )
+            response.raise_for_status()
+            emails = response.json().get("data", [])
+            del response
+
+        if preview_only:
+            return self._iterate(project(self._normalize_email(email)) for email in emails)
+        return self._hydrate_stream(emails, concurrency)
+
+    @staticmethod
+    async def _iterate(emails: Iterable[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        for email in emails:
+            yield email
+
+    async def _hydrate_stream(self, emails: List[Dict[str, Any]], concurrency: int) -> AsyncIterator[Dict[str, Any]]:
+        """Hydrate list emails with bounded concurrency, yielding each as it completes"""
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            async def hydrate(email: Dict[str, Any]) -> Dict[str, Any]:
+                await self._hydrate_email(client, self._normalize_email(email))
+                return project(email, hydrated=True)
+
+            # Pop emails off the list as they are scheduled so yielded ones can be freed
+            emails.reverse()
+            pending = set()
+            try:
+                while emails or pending:
+                    while emails and len(pending) < concurrency:
+                        pending.add(asyncio.create_task(hydrate(emails.pop())))
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+            finally:
+                for task in pending:
+                    task.cancel()
+                # Let cancelled hydrations unwind before the client closes
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def _email_list_params(self,
+                           preview_only: bool,
+                           lead_email: Optional[str],
+                           campaign_id: Optional[str],
+                           email_type: str,
+                           label: Optional[str]) -> Dict[str, str]:
+        # Only include supported parameters
+        params = {
+            "workspace_id": self.workspace_id,
+            "preview_only": "true" if preview_only else "false",
+            "email_type": email_type
+        }
+        if lead_email:
+            params["lead"] = lead_email
+        if campaign_id:
+            params["campaign_id"] = campaign_id
+        if label:
+            params["label"] = label
+        return params
+
+    @staticmethod
+    def _normalize_body(body: Any) -> Dict[str, str]:
+        if isinstance(body, str):
+            return {"text": body, "html": body}
+        if isinstance(body, dict):
+            return {
+                "text": body.get("text", ""),
+                "html": body.get("html", "")
+            }
+        return {"text": "", "html": ""}
+
+    def _normalize_email(self, email: Dict[str, Any]) -> Dict[str, Any]:
+        """Ensure required fields exist on an email from the Unibox list"""
+        email["id"] = email.get("id", "")
+        email["message_id"] = email.get("message_id", "")
+        email["subject"] = email.get("subject", "")
+        email["from_address_email"] = email.get("from_address_email", "")
+        email["from_address_json"] = email.get("from_address_json", [{"address": email.get("from_address_email", ""), "name": ""}])
+        email["to_address_json"] = email.get("to_address_json", [])
+        email["cc_address_json"] = email.get("cc_address_json", [])
+        email["timestamp_created"] = email.get("timestamp_created")
+        email["content_preview"] = email.get("content_preview", "")
+        email["body"] = self._normalize_body(email.get("body"))
+        email["thread"] = []
+        email["label"] = email.get("label")
+        email["campaign_id"] = email.get("campaign_id")
+        email["lead_id"] = email.get("lead_id")
+        email["thread_id"] = email.get("thread_id")
+        email["tags"] = email.get("tags") or []
+        email["is_unread"] = email.get("is_unread", False)
+        return email
+
+    async def _hydrate_email(self, client: httpx.AsyncClient, email: Dict[str, Any]):
+        """Fetch the full thread for an email and take its full body from it"""
+        if not email.get("thread_id"):
+            return
+        try:
+            thread_response = await client.get(
+                f"{self.base_url}/unibox/thread/{email['thread_id']}",
+                headers=self.headers,
+                params={"workspace_id": self.workspace_id}
+            )
+            thread_response.raise_for_status()
+            thread_data = thread_response.json()
+            email["thread"] = thread_data.get("data", [])
+            
+            # Get the full body of the current email from the thread
+            for thread_email in email["thread"]:
+                if thread_email.get("id") == email["id"]:
+                    email["body"] = self._normalize_body(thread_email.get("body", {}))
+                    break
+        except httpx.HTTPError as e:
+            logger.warning(f"Error fetching thread {email.get('thread_id')}: {str(e)}")
+            if hasattr(e, 'response') and e.response is not None:
+                logger.warning(f"Response content: {e.response.text}")
+            email["thread"] = []
+
     async def send_email(self, to: str, subject: str, body: str, reply_to_id: Optional[str] = None) -> Dict[str, Any]:
         """Send email through Pipl.ai"""
         sender_email = os.getenv("PIPL_SENDER_EMAIL", "noreply@caeros.com")
@@ -194,7 +282,7 @@ class PiplAPI:
                 logger.error(f"Response content: {e.response.text}")
             raise
 
-    async def get_campaigns(self) -> List[Dict[str, Any]]:
+    async def get_campaigns(self, raise_errors: bool = False) -> List[Dict[str, Any]]:
         """Get all campaigns"""
         params = {"workspace_id": self.workspace_id}
         try:
@@ -208,6 +296,8 @@ class PiplAPI:
                 return response.json()
         except httpx.HTTPError as e:
             logger.error(f"Error fetching campaigns: {str(e)}")
+            if raise_errors:
+                raise
             # Return empty list instead of raising an error
             return []
 
@@ -231,7 +321,7 @@ class PiplAPI:
             logger.error(f"Error adding lead to sequence: {str(e)}")
             raise
 
-    async def get_tags(self) -> List[Dict[str, Any]]:
+    async def get_tags(self, raise_errors: bool = False) -> List[Dict[str, Any]]:
         """Get all tags"""
         params = {"workspace_id": self.workspace_id}
         try:
@@ -245,6 +335,8 @@ class PiplAPI:
                 return response.json()
         except httpx.HTTPError as e:
             logger.error(f"Error fetching tags: {str(e)}")
+            if raise_errors:
+                raise
             # Return empty list instead of raising an error
             return []
 
@@ -345,24 +437,79 @@ class PiplAPI:
 
     async def update_email_label(self, email_id: str, label: str) -> Dict[str, Any]:
         """Update email label"""
-        data = {
-            "workspace_id": self.workspace_id,
-            "email_id": email_id,
-            "label": label
-        }
+        try:
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                result = await self._post_email_label(client, email_id, label)
+                self.patch_cached_labels({email_id: label})
+                return result
+        except httpx.HTTPError as e:
+            logger.error(f"Error updating email label: {str(e)}")
+            raise
+
+    async def update_email_labels(self, updates: List[Dict[str, str]], concurrency: int = 10) -> List[Dict[str, Any]]:
+        """Update labels for many emails concurrently and patch the cached emails in place"""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def update_one(client: httpx.AsyncClient, email_id: str, label: str) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    await self._post_email_label(client, email_id, label)
+                    return {"email_id": email_id, "label": label, "success": True}
+                except httpx.HTTPError as e:
+                    logger.error(f"Error updating label for email {email_id}: {str(e)}")
+                    return {"email_id": email_id, "label": label, "success": False, "error": str(e)}
+
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            results = await asyncio.gather(*[
+                update_one(client, update["email_id"], update["label"])
+                for update in updates
+            ])
+
+        self.patch_cached_labels({r["email_id"]: r["label"] for r in results if r["success"]})
+        return results
+
+    async def mark_thread_read(self, thread_id: str) -> Dict[str, Any]:
+        """Mark an email thread as read"""
+        data = {"workspace_id": self.workspace_id}
         try:
             async with httpx.AsyncClient(timeout=30.0) as client:
                 response = await client.post(
-                    f"{self.base_url}/unibox/emails/label",
+                    f"{self.base_url}/unibox/threads/{thread_id}/mark-as-read",
                     headers=self.headers,
                     json=data
                 )
                 response.raise_for_status()
+                self.patch_cached_read_state({}, {thread_id: False})
                 return response.json()
         except httpx.HTTPError as e:
-            logger.error(f"Error updating email label: {str(e)}")
+            logger.error(f"Error marking thread read: {str(e)}")
             raise
 
+    async def _post_email_label(self, client: httpx.AsyncClient, email_id: str, label: str) -> Dict[str, Any]:
+        """Send a single label update to Pipl.ai using an existing client"""
+        data = {
+            "workspace_id": self.workspace_id,
+            "email_id": email_id,
+            "label": label
+        }
+        response = await client.post(
+            f"{self.base_url}/unibox/emails/label",
+            headers=self.headers,
+            json=data
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def patch_cached_labels(self, labels: Dict[str, str]):
+        """Apply label changes to every cached email list and thread without refetching"""
+        if labels:
+            self.email_cache.patch_labels(labels)
+
+    def patch_cached_read_state(self, email_ids: Dict[str, bool], thread_ids: Optional[Dict[str, bool]] = None):
+        """Apply read/unread changes to cached emails without refetching"""
+        if email_ids or thread_ids:
+            self.email_cache.patch_unread(email_ids, thread_ids)
+
     def invalidate_email_cache(self):
         """Clear the email cache"""
         self.email_cache.clear()
@@ -371,6 +518,81 @@ class PiplAPI:
         """Clear the label cache"""
         self.label_cache.clear()
 
+    @staticmethod
+    def _index_by_id(response: Any) -> Dict[str, Dict[str, Any]]:
+        """Build an id-to-record dict from a list response (bare or wrapped in "data")"""
+        if isinstance(response, dict):
+            response = response.get("data", [])
+        if not isinstance(response, list):
+            return {}
+        index = {}
+        for record in response:
+            if isinstance(record, dict):
+                record_id = record.get("_id") or record.get("id")
+                if record_id:
+                    index[str(record_id)] = record
+        return index
+
+    async def refresh_metadata(self):
+        """Reload campaigns and tags into the id-to-record dicts.
+
+        A failed fetch keeps the last good copy of that dict and schedules a
+        retry after ``metadata_retry`` seconds instead of the full TTL.
+        """
+        campaigns, tags = await asyncio.gather(
+            self.get_campaigns(raise_errors=True),
+            self.get_tags(raise_errors=True),
+            return_exceptions=True
+        )
+        failed = False
+        if isinstance(campaigns, Exception):
+            failed = True
+        else:
+            self.campaigns_by_id = self._index_by_id(campaigns)
+        if isinstance(tags, Exception):
+            failed = True
+        else:
+            self.tags_by_id = self._index_by_id(tags)
+        self.metadata_expires_at = time.monotonic() + (self.metadata_retry if failed else self.metadata_ttl)
+        if failed:
+            logger.warning(f"Metadata refresh incomplete, retrying in {self.metadata_retry}s")
+        else:
+            logger.info(f"Refreshed metadata: {len(self.campaigns_by_id)} campaigns, {len(self.tags_by_id)} tags")
+
+    def _metadata_stale(self) -> bool:
+        return self.metadata_expires_at is None or time.monotonic() >= self.metadata_expires_at
+
+    async def ensure_metadata(self):
+        """Load metadata if it has never been loaded, has expired or the last load failed"""
+        if not self._metadata_stale():
+            return
+        async with self._metadata_lock:
+            if self._metadata_stale():
+                await self.refresh_metadata()
+
+    async def run_metadata_refresh(self, interval: float):
+        """Keep campaign and tag metadata fresh until cancelled"""
+        while True:
+            try:
+                await self.refresh_metadata()
+            except Exception as e:
+                logger.error(f"Error refreshing metadata: {str(e)}")
+            # Come back early when the refresh failed and scheduled a retry
+            delay = interval
+            if self.metadata_expires_at is not None:
+                delay = min(interval, max(1.0, self.metadata_expires_at - time.monotonic()))
+            await asyncio.sleep(delay)
+
+    def enrich(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Add campaign name and tag details to an email or lead from the metadata dicts"""
+        campaign = self.campaigns_by_id.get(row.get("campaign_id") or "")
+        row["campaign_name"] = campaign.get("name") if campaign else None
+        tags = row.get("tags")
+        row["tag_details"] = [
+            self.tags_by_id[str(t)] for t in tags if str(t) in self.tags_by_id
+        ] if isinstance(tags, list) else []
+        return row
+
     async def get_leads(
         self,
         campaign_id: Optional[str] = None,
@@ -382,7 +604,8 @@ class PiplAPI:
         page: Optional[int] = 1,
         limit: Optional[int] = 10,
         sort: Optional[str] = "_id",
-        direction: Optional[str] = "asc"
+        direction: Optional[str] = "asc",
+        raise_errors: bool = False
     ) -> Dict[str, Any]:
         """Get leads from Pipl.ai API with filtering and pagination"""
         
@@ -461,6 +684,8 @@ class PiplAPI:
             logger.error(f"Error fetching leads: {str(e)}")
             if hasattr(e, 'response') and e.response is not None:
                 logger.error(f"Response content: {e.response.text}")
+            if raise_errors:
+                raise
             # Return empty data on error instead of raising
             return {
                 "data": [],
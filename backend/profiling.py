@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+from urllib.parse import parse_qs
+
+try:
+    from pyinstrument import Profiler
+except ImportError:  # Profiling is optional
+    Profiler = None
+
+logger = logging.getLogger("profiling")
+
+
+class ProfileStore:
+    """Bounded on-disk ring of request profiles"""
+
+    def __init__(self, directory: str, max_files: int = 50):
+        self.directory = Path(directory)
+        self.max_files = max_files
+
+    def save(self, profile_id: str, meta: Dict[str, Any], html: str):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        (self.directory / f"{profile_id}.html").write_text(html)
+        (self.directory / f"{profile_id}.json").write_text(json.dumps(meta))
+        self._trim()
+
+    def _trim(self):
+        metas = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        for meta_path in metas[:max(0, len(metas) - self.max_files)]:
+            meta_path.unlink(missing_ok=True)
+            meta_path.with_suffix(".html").unlink(missing_ok=True)
+
+    def list(self) -> List[Dict[str, Any]]:
+        if not self.directory.exists():
+            return []
+        profiles = []
+        for meta_path in self.directory.glob("*.json"):
+            try:
+                profiles.append(json.loads(meta_path.read_text()))
+            except (OSError, ValueError):
+                continue
+        return sorted(profiles, key=lambda p: p["created_at"], reverse=True)
+
+    def read(self, profile_id: str) -> Optional[str]:
+        # Ids are generated by us; reject anything that could escape the directory
+        if not profile_id.isalnum():
+            return None
+        path = self.directory / f"{profile_id}.html"
+        return path.read_text() if path.exists() else None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles requests on demand or by sampling.
+
+    On demand: a request carrying ``X-Profile: <token>`` (or ``?profile=<token>``)
+    matching ``token`` is always profiled and the response gets an
+    ``X-Profile-Id`` header. Sampled: a ``sample_rate`` fraction of requests is
+    profiled and kept only if it took longer than ``slow_ms``. Only one profile
+    runs at a time: sampled requests skip profiling while one is running, and
+    on-demand requests wait for it. Requests to ``/api/admin/`` are never
+    profiled, so reading profiles does not push real ones out of the ring.
+    """
+
+    def __init__(self, app, store: ProfileStore, token: Optional[str] = None,
+                 sample_rate: float = 0.0, slow_ms: float = 1000.0):
+        self.app = app
+        self.store = store
+        self.token = token
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self._lock = asyncio.Lock()
+
+    def _requested(self, scope) -> bool:
+        if not self.token:
+            return False
+        for name, value in scope.get("headers", []):
+            if name == b"x-profile" and value.decode() == self.token:
+                return True
+        query = scope.get("query_string", b"")
+        if b"profile=" in query:
+            return self.token in parse_qs(query.decode()).get("profile", [])
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path", "").startswith("/api/admin/"):
+            return await self.app(scope, receive, send)
+
+        forced = self._requested(scope)
+        if not forced and (self.sample_rate <= 0 or self._lock.locked() or random.random() >= self.sample_rate):
+            return await self.app(scope, receive, send)
+
+        async with self._lock:
+            await self._profile(scope, receive, send, forced)
+
+    async def _profile(self, scope, receive, send, forced: bool):
+        profile_id = uuid.uuid4().hex
+
+        async def send_with_header(message):
+            if forced and message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile_id.encode())
+                ]
+            await send(message)
+
+        profiler = Profiler(async_mode="enabled")
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_header)
+        finally:
+            profiler.stop()
+            duration_ms = (time.perf_counter() - started) * 1000
+            if forced or duration_ms >= self.slow_ms:
+                meta = {
+                    "id": profile_id,
+                    "method": scope.get("method"),
+                    "path": scope.get("path"),
+                    "query": scope.get("query_string", b"").decode(),
+                    "duration_ms": round(duration_ms, 1),
+                    "trigger": "request" if forced else "sampled",
+                    "created_at": time.time()
+                }
+                try:
+                    await asyncio.to_thread(self.store.save, profile_id, meta, profiler.output_html())
+                except Exception as e:
+                    logger.error(f"Error saving profile {profile_id}: {str(e)}")
+
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+# Token for reading stored profiles; defaults to PROFILE_TOKEN
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN") or PROFILE_TOKEN
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "2000"))
+
+profile_store = ProfileStore(
+    directory=os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), "profiles")),
+    max_files=int(os.getenv("PROFILE_MAX_FILES", "50"))
+)
+
+
+def install_profiling(app):
+    """Add the profiling middleware only when a mode is enabled, so it costs nothing when off"""
+    if not PROFILE_TOKEN and PROFILE_SAMPLE_RATE <= 0:
+        return
+    if Profiler is None:
+        logger.warning("Profiling is configured but pyinstrument is not installed")
+        return
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=profile_store,
+        token=PROFILE_TOKEN,
+        sample_rate=PROFILE_SAMPLE_RATE,
+        slow_ms=PROFILE_SLOW_MS
+    )
+    if not PROFILE_ADMIN_TOKEN:
+        logger.warning("Profiles are being recorded but cannot be read; set PROFILE_ADMIN_TOKEN")
+    logger.info(f"Request profiling enabled (sample_rate={PROFILE_SAMPLE_RATE}, slow_ms={PROFILE_SLOW_MS})")
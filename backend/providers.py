@@ -0,0 +1,280 @@
+import asyncio
+import heapq
+import logging
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+
+from piplai import PiplAPI, pipl_api
+from emailbison import EmailBisonAPI, emailbison
+
+logger = logging.getLogger("providers")
+
+
+def timestamp_key(email: Dict[str, Any]) -> float:
+    """Sort key for normalized emails; unparseable timestamps sort last"""
+    value = email.get("timestamp_created")
+    if not value:
+        return 0.0
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return 0.0
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def normalize_lead(lead: Dict[str, Any], provider: str) -> Dict[str, Any]:
+    """Map a provider lead record onto the common lead shape"""
+    return {
+        "id": str(lead.get("_id") or lead.get("id") or ""),
+        "email": lead.get("email", ""),
+        "first_name": lead.get("first_name", ""),
+        "last_name": lead.get("last_name", ""),
+        "company_name": lead.get("company_name") or lead.get("company", ""),
+        "status": lead.get("status"),
+        "label": lead.get("label"),
+        "campaign_id": lead.get("campaign_id"),
+        "current_step": lead.get("current_step"),
+        "total_steps": lead.get("total_steps"),
+        "provider": provider
+    }
+
+
+# Separates the provider prefix from the upstream id in merged-inbox ids
+ID_SEPARATOR = ":"
+PREFIXED_PROVIDERS = {"emailbison"}
+
+
+class UnsupportedOperation(Exception):
+    """Raised when a provider cannot perform an action"""
+    pass
+
+
+class EmailProvider(ABC):
+    """Common interface for email providers.
+
+    ``get_emails`` must return normalized emails (the ``PiplEmail`` shape plus a
+    ``provider`` field) sorted newest first by ``timestamp_created``, so results
+    from several providers can be combined with a streaming merge. Ids of
+    providers other than Pipl.ai are prefixed with ``"<name>:"`` so actions on
+    a row can be routed back with ``resolve_id``.
+    """
+
+    name = "provider"
+    supports_replies = True
+
+    @abstractmethod
+    async def get_emails(self,
+                         preview_only: bool = True,
+                         lead_email: Optional[str] = None,
+                         campaign_id: Optional[str] = None,
+                         email_type: str = "all",
+                         label: Optional[str] = None) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def send_email(self, to: str, subject: str, body: str, reply_to_id: Optional[str] = None) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    async def get_leads(self, email: Optional[str] = None, page: int = 1, limit: int = 10) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def add_to_sequence(self, email: str, sequence_id: str) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    async def update_email_label(self, email_id: str, label: str) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    async def mark_thread_read(self, thread_id: str) -> Dict[str, Any]:
+        ...
+
+
+class PiplProvider(EmailProvider):
+    name = "pipl"
+
+    def __init__(self, api: PiplAPI):
+        self.api = api
+
+    async def get_emails(self,
+                         preview_only: bool = True,
+                         lead_email: Optional[str] = None,
+                         campaign_id: Optional[str] = None,
+                         email_type: str = "all",
+                         label: Optional[str] = None) -> List[Dict[str, Any]]:
+        emails = await self.api.get_emails(
+            preview_only=preview_only,
+            lead_email=lead_email,
+            campaign_id=campaign_id,
+            email_type=email_type,
+            label=label
+        )
+        for email in emails:
+            email["provider"] = self.name
+        # Already in order in the common case, so this is a linear pass
+        return sorted(emails, key=timestamp_key, reverse=True)
+
+    async def send_email(self, to: str, subject: str, body: str, reply_to_id: Optional[str] = None) -> Dict[str, Any]:
+        return await self.api.send_email(to=to, subject=subject, body=body, reply_to_id=reply_to_id)
+
+    async def get_leads(self, email: Optional[str] = None, page: int = 1, limit: int = 10) -> List[Dict[str, Any]]:
+        response = await self.api.get_leads(email=email, page=page, limit=limit)
+        return [normalize_lead(lead, self.name) for lead in response.get("data", [])]
+
+    async def add_to_sequence(self, email: str, sequence_id: str) -> Dict[str, Any]:
+        return await self.api.add_lead_to_sequence(email, sequence_id)
+
+    async def update_email_label(self, email_id: str, label: str) -> Dict[str, Any]:
+        return await self.api.update_email_label(email_id, label)
+
+    async def mark_thread_read(self, thread_id: str) -> Dict[str, Any]:
+        return await self.api.mark_thread_read(thread_id)
+
+
+class EmailBisonProvider(EmailProvider):
+    name = "emailbison"
+    supports_replies = False
+
+    # Folders that make up each email_type
+    FOLDERS = {
+        "all": ["inbox", "sent"],
+        "received": ["inbox"],
+        "sent": ["sent"]
+    }
+
+    def __init__(self, api: EmailBisonAPI):
+        self.api = api
+
+    def _normalize_email(self, email: Dict[str, Any]) -> Dict[str, Any]:
+        body = email.get("body") or ""
+        sender = email.get("sender_email", "")
+        recipient = email.get("recipient_email", "")
+        return {
+            # Prefix ids so they cannot collide with Pipl.ai ids in the merged inbox
+            "id": f"{self.name}{ID_SEPARATOR}{email.get('id', '')}",
+            "message_id": str(email.get("id", "")),
+            "subject": email.get("subject", ""),
+            "from_address_email": sender,
+            "from_address_json": [{"address": sender, "name": ""}],
+            "to_address_json": [{"address": recipient, "name": ""}] if recipient else [],
+            "cc_address_json": [],
+            "timestamp_created": email.get("created_at"),
+            "content_preview": body[:200],
+            "body": {"text": body, "html": body},
+            "thread": [],
+            "label": None,
+            "campaign_id": None,
+            "lead_id": None,
+            "thread_id": None,
+            "is_unread": False,
+            "provider": self.name
+        }
+
+    async def get_emails(self,
+                         preview_only: bool = True,
+                         lead_email: Optional[str] = None,
+                         campaign_id: Optional[str] = None,
+                         email_type: str = "all",
+                         label: Optional[str] = None) -> List[Dict[str, Any]]:
+        # EmailBison has no campaigns or labels, so those filters match nothing here
+        if campaign_id or label:
+            return []
+        folders = self.FOLDERS.get(email_type, self.FOLDERS["all"])
+        results = await asyncio.gather(*[self.api.get_emails(folder=folder) for folder in folders])
+        emails = [self._normalize_email(email) for result in results for email in result]
+        if lead_email:
+            emails = [
+                email for email in emails
+                if lead_email in (email["from_address_email"], *(a["address"] for a in email["to_address_json"]))
+            ]
+        return sorted(emails, key=timestamp_key, reverse=True)
+
+    async def send_email(self, to: str, subject: str, body: str, reply_to_id: Optional[str] = None) -> Dict[str, Any]:
+        if reply_to_id:
+            raise UnsupportedOperation("EmailBison does not support replies")
+        return await self.api.send_email(to=to, subject=subject, body=body)
+
+    async def get_leads(self, email: Optional[str] = None, page: int = 1, limit: int = 10) -> List[Dict[str, Any]]:
+        # EmailBison does not expose leads
+        return []
+
+    async def add_to_sequence(self, email: str, sequence_id: str) -> Dict[str, Any]:
+        return await self.api.add_to_sequence(sequence_id, email)
+
+    async def update_email_label(self, email_id: str, label: str) -> Dict[str, Any]:
+        raise UnsupportedOperation("EmailBison does not support labels")
+
+    async def mark_thread_read(self, thread_id: str) -> Dict[str, Any]:
+        raise UnsupportedOperation("EmailBison does not support read state")
+
+
+def configured_providers() -> List[EmailProvider]:
+    """Providers with credentials configured; Pipl.ai is always enabled"""
+    providers: List[EmailProvider] = [pipl_provider]
+    if emailbison.api_key:
+        providers.append(EmailBisonProvider(emailbison))
+    return providers
+
+
+def resolve_id(item_id: str) -> Tuple[EmailProvider, str]:
+    """Find the provider that owns a merged-inbox id and the id it uses upstream"""
+    prefix, separator, raw_id = item_id.partition(ID_SEPARATOR)
+    if separator and prefix in PREFIXED_PROVIDERS:
+        for provider in providers:
+            if provider.name == prefix:
+                return provider, raw_id
+        raise UnsupportedOperation(f"Provider {prefix} is not configured")
+    return pipl_provider, item_id
+
+
+def merge_sorted(email_lists: List[List[Dict[str, Any]]]) -> Iterator[Dict[str, Any]]:
+    """Lazily k-way merge newest-first email lists"""
+    return heapq.merge(*email_lists, key=timestamp_key, reverse=True)
+
+
+async def get_merged_emails(providers: List[EmailProvider],
+                            timeout: float = 30.0,
+                            **filters) -> Iterator[Dict[str, Any]]:
+    """Query all providers concurrently and merge their results by timestamp.
+
+    With several providers, one that fails or exceeds ``timeout`` is skipped so
+    it cannot stall the inbox. A single provider is never timed out, since
+    there is nothing to show without it. If every provider fails, the first
+    error is raised; a timeout is raised as ``asyncio.TimeoutError`` naming
+    the provider.
+    """
+    budget = timeout if len(providers) > 1 else None
+    results = await asyncio.gather(*[
+        asyncio.wait_for(provider.get_emails(**filters), timeout=budget)
+        for provider in providers
+    ], return_exceptions=True)
+
+    email_lists = []
+    errors = []
+    for provider, result in zip(providers, results):
+        if isinstance(result, BaseException):
+            if isinstance(result, asyncio.TimeoutError):
+                result = asyncio.TimeoutError(f"Provider {provider.name} timed out after {timeout}s")
+                logger.warning(str(result))
+            else:
+                logger.error(f"Provider {provider.name} failed: {str(result)}")
+            errors.append(result)
+        else:
+            email_lists.append(result)
+
+    if errors and not email_lists:
+        raise errors[0]
+    return merge_sorted(email_lists)
+
+
+pipl_provider = PiplProvider(pipl_api)
+providers = configured_providers()
+PROVIDER_TIMEOUT = float(os.getenv("PROVIDER_TIMEOUT", "30"))
+# Hydrated requests fetch every thread, so they get a larger budget
+PROVIDER_HYDRATION_TIMEOUT = float(os.getenv("PROVIDER_HYDRATION_TIMEOUT", "180"))
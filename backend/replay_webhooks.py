@@ -0,0 +1,46 @@
+"""Replay recorded Pipl.ai webhook events against a local backend.
+
+Reads one JSON event per line and POSTs each to /api/webhooks/pipl, signed
+with the same secret the backend checks:
+
+    python replay_webhooks.py events.ndjson --secret $PIPL_WEBHOOK_SECRET
+"""
+import argparse
+import asyncio
+import json
+import os
+
+import httpx
+
+from webhooks import sign
+
+
+async def replay(path: str, url: str, secret: str, delay: float):
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                body = json.dumps(json.loads(line)).encode()
+                response = await client.post(
+                    url,
+                    content=body,
+                    headers={
+                        "Content-Type": "application/json",
+                        "X-Pipl-Signature": sign(secret, body)
+                    }
+                )
+                print(f"{response.status_code} {response.text}")
+                if delay:
+                    await asyncio.sleep(delay)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded webhook events")
+    parser.add_argument("events", help="File with one JSON event per line")
+    parser.add_argument("--url", default="http://localhost:8000/api/webhooks/pipl")
+    parser.add_argument("--secret", default=os.getenv("PIPL_WEBHOOK_SECRET", ""))
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait between events")
+    args = parser.parse_args()
+    asyncio.run(replay(args.events, args.url, args.secret, args.delay))
@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import sqlite3
+import time
+from typing import List, Dict, Any, Optional
+
+from cachetools import TTLCache
+from piplai import PiplAPI, pipl_api
+from lead_index import LeadIndex, lead_index
+
+logger = logging.getLogger("webhooks")
+
+# Events that add emails; cached query results can't be patched for these, only dropped
+NEW_EMAIL_EVENTS = {"email.received", "email.replied", "email.sent"}
+
+
+def sign(secret: str, body: bytes) -> str:
+    """HMAC-SHA256 signature of a webhook body, as sent in X-Pipl-Signature"""
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret: str, body: bytes, signature: Optional[str]) -> bool:
+    if not secret or not signature:
+        return False
+    expected = sign(secret, body)
+    if not signature.startswith("sha256="):
+        signature = "sha256=" + signature
+    return hmac.compare_digest(expected, signature)
+
+
+class EmailMirror:
+    """Optional local SQLite mirror of label and read state received through webhooks"""
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS email_state ("
+            "email_id TEXT PRIMARY KEY, label TEXT, is_unread INTEGER, updated_at REAL NOT NULL)"
+        )
+
+    def apply(self, labels: Dict[str, str], read_state: Dict[str, bool]):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO email_state (email_id, label, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(email_id) DO UPDATE SET label = excluded.label, updated_at = excluded.updated_at",
+                [(email_id, label, now) for email_id, label in labels.items()]
+            )
+            self.conn.executemany(
+                "INSERT INTO email_state (email_id, is_unread, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(email_id) DO UPDATE SET is_unread = excluded.is_unread, updated_at = excluded.updated_at",
+                [(email_id, int(is_unread), now) for email_id, is_unread in read_state.items()]
+            )
+
+
+class WebhookProcessor:
+    """Deduplicates webhook events and applies them to the caches in batches.
+
+    Events are expected as ``{"id": ..., "type": ..., "data": {...}}``.
+    ``submit`` only records the id and enqueues the event, so the webhook
+    response never waits on cache or mirror updates.
+    """
+
+    def __init__(self, api: PiplAPI, leads: LeadIndex, mirror: Optional[EmailMirror] = None,
+                 queue_size: int = 10000, batch_size: int = 100, dedup_ttl: float = 86400):
+        self.api = api
+        self.leads = leads
+        self.mirror = mirror
+        self.batch_size = batch_size
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.seen = TTLCache(maxsize=100000, ttl=dedup_ttl)
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, events: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Queue new events; raises asyncio.QueueFull if there is no room"""
+        accepted = duplicates = 0
+        for event in events:
+            event_id = event.get("id")
+            if event_id and event_id in self.seen:
+                duplicates += 1
+                continue
+            self.queue.put_nowait(event)
+            if event_id:
+                self.seen[event_id] = True
+            accepted += 1
+        return {"accepted": accepted, "duplicates": duplicates}
+
+    async def apply_batch(self, events: List[Dict[str, Any]]):
+        labels: Dict[str, str] = {}
+        read_state: Dict[str, bool] = {}
+        thread_read_state: Dict[str, bool] = {}
+        new_emails = False
+
+        # Later events in the batch win, so coalesce before touching the caches
+        for event in events:
+            event_type = event.get("type", "")
+            data = event.get("data") or {}
+            if event_type in NEW_EMAIL_EVENTS:
+                new_emails = True
+            elif event_type == "email.label_updated" and data.get("email_id"):
+                labels[data["email_id"]] = data.get("label")
+            elif event_type in ("email.read", "email.unread"):
+                is_unread = event_type == "email.unread"
+                if data.get("email_id"):
+                    read_state[data["email_id"]] = is_unread
+                if data.get("thread_id"):
+                    thread_read_state[data["thread_id"]] = is_unread
+            elif event_type == "lead.updated" and data.get("email"):
+                self.leads.upsert(data)
+            else:
+                logger.debug(f"Ignoring webhook event type {event_type}")
+
+        if new_emails:
+            self.api.invalidate_email_cache()
+        else:
+            self.api.patch_cached_labels(labels)
+            self.api.patch_cached_read_state(read_state, thread_read_state)
+        if self.mirror is not None and (labels or read_state):
+            await asyncio.to_thread(self.mirror.apply, labels, read_state)
+
+    async def _worker(self):
+        while True:
+            events = [await self.queue.get()]
+            while len(events) < self.batch_size and not self.queue.empty():
+                events.append(self.queue.get_nowait())
+            try:
+                await self.apply_batch(events)
+            except Exception as e:
+                logger.error(f"Error applying {len(events)} webhook events: {str(e)}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._worker())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+WEBHOOK_SECRET = os.getenv("PIPL_WEBHOOK_SECRET", "")
+
+_mirror_path = os.getenv("WEBHOOK_MIRROR_PATH")
+webhook_processor = WebhookProcessor(
+    pipl_api,
+    lead_index,
+    mirror=EmailMirror(_mirror_path) if _mirror_path else None,
+    queue_size=int(os.getenv("WEBHOOK_QUEUE_SIZE", "10000")),
+    batch_size=int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+)
@@ -16,7 +16,8 @@ import {
 } from '@chakra-ui/react'
 import { format, isValid, parseISO } from 'date-fns'
 import { useState } from 'react'
-import api from '../lib/api'
+import api, { newIdempotencyKey } from '../lib/api'
+import { useDeliveryTracking } from '../lib/useDeliveryTracking'
 
 interface EmailDetailProps {
   email: {
@@ -68,6 +69,7 @@ const formatAddressList = (addresses: Array<{ address: string; name?: string }>)
 
 export default function EmailDetail({ email }: EmailDetailProps) {
   const toast = useToast()
+  const trackDelivery = useDeliveryTracking()
   const [isReplying, setIsReplying] = useState(false)
   const [showReply, setShowReply] = useState(false)
   const [replyData, setReplyData] = useState({
@@ -75,6 +77,8 @@ export default function EmailDetail({ email }: EmailDetailProps) {
     subject: `Re: ${email.subject}`,
     body: ''
   })
+  // One key per reply draft; a retry of the same draft reuses it
+  const [replyKey, setReplyKey] = useState(newIdempotencyKey)
 
   const mutedColor = useColorModeValue('gray.600', 'gray.400')
   const borderColor = useColorModeValue('gray.200', 'gray.700')
@@ -85,19 +89,21 @@ export default function EmailDetail({ email }: EmailDetailProps) {
   const handleReply = async () => {
     try {
       setIsReplying(true)
-      await api.emails.send({
+      const queued = await api.emails.send({
         to: replyData.to,
         subject: replyData.subject,
         body: replyData.body,
         reply_to_id: email.id
-      })
+      }, replyKey)
       toast({
-        title: 'Reply sent successfully',
-        status: 'success',
+        title: 'Reply queued for sending',
+        status: 'info',
         duration: 3000,
         isClosable: true,
       })
+      trackDelivery(queued, 'Reply')
       setShowReply(false)
+      setReplyKey(newIdempotencyKey())
       setReplyData({
         to: email.from_address_email,
         subject: `Re: ${email.subject}`,
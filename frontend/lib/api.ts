@@ -60,6 +60,10 @@ export interface PiplEmail {
   lead_id?: string
   thread_id?: string
   is_unread?: boolean
+  provider?: string
+  tags?: string[]
+  campaign_name?: string | null
+  tag_details?: Record<string, any>[]
 }
 
 export interface SendEmailRequest {
@@ -69,6 +73,18 @@ export interface SendEmailRequest {
   reply_to_id?: string
 }
 
+export interface SendStatus {
+  message_id: string
+  status: 'queued' | 'sending' | 'sent' | 'failed'
+  to: string
+  subject: string
+  reply_to_id?: string | null
+  attempts: number
+  last_error?: string | null
+  created_at: number
+  updated_at: number
+}
+
 export interface Lead {
   _id: string;
   organization_id: string;
@@ -108,6 +124,29 @@ export interface Lead {
   total_steps: number;
 }
 
+// Key identifying one draft, so a retried send is only delivered once.
+// Uses getRandomValues because randomUUID is missing outside secure contexts.
+export const newIdempotencyKey = (): string => {
+  const bytes = new Uint8Array(16)
+  crypto.getRandomValues(bytes)
+  return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('')
+}
+
+export interface BatchSubRequest {
+  id?: string
+  method?: 'GET' | 'POST'
+  path: string
+  params?: Record<string, unknown>
+  body?: unknown
+  headers?: Record<string, string>
+}
+
+export interface BatchSubResponse<T = any> {
+  id: string
+  status: number
+  body: T
+}
+
 export interface LeadsResponse {
   data: Lead[];
   total: number;
@@ -123,16 +162,76 @@ const api = {
       campaign_id?: string
       email_type?: 'all' | 'sent' | 'received'
       label?: string
+      enrich?: boolean
+      include_lead?: boolean
     }) => {
       const response = await axiosInstance.get<PiplEmail[]>('/api/emails', { params })
       return response.data
     },
 
-    send: async (data: SendEmailRequest) => {
-      const response = await axiosInstance.post('/api/emails/send', data)
+    stream: async (
+      onEmail: (email: PiplEmail) => void,
+      params?: {
+        preview_only?: boolean
+        lead_email?: string
+        campaign_id?: string
+        email_type?: 'all' | 'sent' | 'received'
+        label?: string
+      }
+    ) => {
+      const query = new URLSearchParams(
+        Object.entries(params || {})
+          .filter(([, value]) => value !== undefined)
+          .map(([key, value]) => [key, String(value)])
+      )
+      const response = await fetch(`${API_URL}/api/emails/stream?${query}`)
+      if (!response.ok || !response.body) {
+        throw new Error(`Failed to stream emails (${response.status})`)
+      }
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      for (;;) {
+        const { done, value } = await reader.read()
+        buffer += decoder.decode(value, { stream: !done })
+        const lines = buffer.split('\n')
+        buffer = lines.pop() || ''
+        for (const line of lines) {
+          if (!line) continue
+          const item = JSON.parse(line)
+          if (item.error) throw new Error(item.error)
+          onEmail(item)
+        }
+        if (done) break
+      }
+    },
+
+    send: async (data: SendEmailRequest, idempotencyKey: string) => {
+      const response = await axiosInstance.post<SendStatus>('/api/emails/send', data, {
+        headers: { 'Idempotency-Key': idempotencyKey }
+      })
+      return response.data
+    },
+
+    sendStatus: async (messageId: string) => {
+      const response = await axiosInstance.get<SendStatus>(`/api/emails/send/${messageId}`)
       return response.data
     },
 
+    // Poll a queued message until the outbox has sent it or given up on it.
+    // Returns the last status seen if neither happens within timeoutMs.
+    waitForDelivery: async (messageId: string, intervalMs = 2000, timeoutMs = 10 * 60 * 1000) => {
+      const deadline = Date.now() + timeoutMs
+      for (;;) {
+        const response = await axiosInstance.get<SendStatus>(`/api/emails/send/${messageId}`)
+        const message = response.data
+        if (message.status === 'sent' || message.status === 'failed' || Date.now() >= deadline) {
+          return message
+        }
+        await new Promise(resolve => setTimeout(resolve, intervalMs))
+      }
+    },
+
     markRead: async (threadId: string) => {
       const response = await axiosInstance.post(`/api/emails/mark-read/${threadId}`)
       return response.data
@@ -171,16 +270,23 @@ const api = {
         params: { label }
       })
       return response.data
+    },
+
+    updateBulk: async (updates: { email_id: string; label: string }[]) => {
+      const response = await axiosInstance.post('/api/emails/labels/bulk', { updates })
+      return response.data
     }
   },
 
   reply: {
-    send: async (data: { to: string; subject: string; body: string; replyToId: string }) => {
+    send: async (data: { to: string; subject: string; body: string; replyToId: string }, idempotencyKey: string) => {
       const response = await axiosInstance.post('/api/emails/send', {
         to: data.to,
         subject: data.subject,
         body: data.body,
         reply_to_id: data.replyToId
+      }, {
+        headers: { 'Idempotency-Key': idempotencyKey }
       })
       return response.data
     }
@@ -198,10 +304,21 @@ const api = {
       limit?: number;
       sort?: string;
       direction?: 'asc' | 'desc';
+      enrich?: boolean;
     }) => {
       const response = await axiosInstance.get<LeadsResponse>('/api/leads', { params });
       return response.data;
+    },
+
+    lookup: async (emails: string[]) => {
+      const response = await axiosInstance.post('/api/leads/lookup', { emails });
+      return response.data.leads;
     }
+  },
+
+  batch: async (requests: BatchSubRequest[]) => {
+    const response = await axiosInstance.post<{ responses: BatchSubResponse[] }>('/api/batch', { requests })
+    return response.data.responses
   }
 }
 
@@ -0,0 +1,52 @@
+import { useCallback } from 'react'
+import { useToast } from '@chakra-ui/react'
+import api, { SendStatus } from './api'
+
+// Sends are only queued by the API; follow one until the outbox is done with it
+// and tell the user how it ended, so a send that fails for good is not silent.
+export function useDeliveryTracking() {
+  const toast = useToast()
+
+  return useCallback(async (queued: SendStatus, what: string): Promise<SendStatus | null> => {
+    let message = queued
+    try {
+      if (message.status !== 'sent' && message.status !== 'failed') {
+        message = await api.emails.waitForDelivery(message.message_id)
+      }
+    } catch (error) {
+      toast({
+        title: `Could not check whether the ${what.toLowerCase()} was sent`,
+        description: error instanceof Error ? error.message : 'An error occurred',
+        status: 'warning',
+        duration: 5000,
+        isClosable: true,
+      })
+      return null
+    }
+
+    if (message.status === 'sent') {
+      toast({
+        title: `${what} sent`,
+        status: 'success',
+        duration: 3000,
+        isClosable: true,
+      })
+    } else if (message.status === 'failed') {
+      toast({
+        title: `${what} to ${message.to} could not be sent`,
+        description: message.last_error || 'Delivery failed after several attempts',
+        status: 'error',
+        duration: null,
+        isClosable: true,
+      })
+    } else {
+      toast({
+        title: `${what} to ${message.to} is still queued`,
+        status: 'warning',
+        duration: 5000,
+        isClosable: true,
+      })
+    }
+    return message
+  }, [toast])
+}
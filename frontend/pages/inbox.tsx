@@ -21,16 +21,20 @@ import Layout from '../components/Layout'
 import EmailList from '../components/EmailList'
 import EmailDetail from '../components/EmailDetail'
 import ComposeEmail from '../components/ComposeEmail'
-import api, { PiplEmail } from '../lib/api'
+import api, { PiplEmail, SendStatus, newIdempotencyKey } from '../lib/api'
+import { useDeliveryTracking } from '../lib/useDeliveryTracking'
 
 export default function Inbox() {
   const toast = useToast()
+  const trackDelivery = useDeliveryTracking()
   const queryClient = useQueryClient()
   const [selectedEmail, setSelectedEmail] = useState<PiplEmail | null>(null)
   const { isOpen: isComposeOpen, onOpen: onComposeOpen, onClose: onComposeClose } = useDisclosure()
   const [searchTerm, setSearchTerm] = useState('')
   const [sortBy, setSortBy] = useState('date')
   const [filterLabel, setFilterLabel] = useState('')
+  // One key per compose draft; a retry of the same draft reuses it
+  const [draftKey, setDraftKey] = useState(newIdempotencyKey)
 
   // Fetch emails with simple query
   const {
@@ -60,16 +64,27 @@ export default function Inbox() {
 
   // Send email mutation
   const sendEmailMutation = useMutation({
-    mutationFn: api.emails.send,
-    onSuccess: () => {
-      queryClient.invalidateQueries({ queryKey: ['emails'] })
+    mutationFn: (data: { to: string; subject: string; body: string; replyToId?: string }) =>
+      api.emails.send({
+        to: data.to,
+        subject: data.subject,
+        body: data.body,
+        reply_to_id: data.replyToId
+      }, draftKey),
+    onSuccess: (queued: SendStatus) => {
+      setDraftKey(newIdempotencyKey())
       onComposeClose()
       toast({
-        title: 'Email sent successfully',
-        status: 'success',
+        title: 'Email queued for sending',
+        status: 'info',
         duration: 3000,
         isClosable: true,
       })
+      trackDelivery(queued, 'Email').then(message => {
+        if (message?.status === 'sent') {
+          queryClient.invalidateQueries({ queryKey: ['emails'] })
+        }
+      })
     },
     onError: (error) => {
       toast({